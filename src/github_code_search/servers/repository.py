@@ -1,20 +1,33 @@
 import asyncio
+import posixpath
+import re
+from collections import Counter
+from collections.abc import Callable, Coroutine, Hashable
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache, partial
 from logging import Logger, getLogger
 from pathlib import Path
-from typing import Annotated, get_args
+from typing import Annotated, Any, TypeVar, get_args
 
 from anyio import mkdtemp, open_file
 from fastmcp import FastMCP
 from fastmcp.tools.tool import Tool
 from git.repo import Repo
-from pydantic import AnyHttpUrl, BaseModel, Field, RootModel, field_validator
+from pydantic import AnyHttpUrl, BaseModel, Field, PrivateAttr, RootModel, field_validator
 from rpygrep import RipGrepFind, RipGrepSearch
-from rpygrep.types import RIPGREP_TYPE_LIST, RipGrepContext, RipGrepSearchResult
+from rpygrep.types import RIPGREP_TYPE_LIST, RipGrepSearchResult
 
 OWNER = Annotated[str, "The owner of the repository."]
 REPO = Annotated[str, "The repository name."]
 BRANCH = Annotated[str, "The branch of the repository."]
 PATH = Annotated[str, "The path of the file."]
+DIRECTORY_PATH = Annotated[str, "The path of the directory. Use an empty string for the root of the repository."]
+DEPTH = Annotated[
+    int,
+    "How many levels of subdirectories to list, between 1 and 10 (values outside this range are clamped). 1 lists only the "
+    "immediate children of the directory.",
+]
+INCLUDE_SIZES = Annotated[bool, "Whether to include the size (in bytes) of each file in the listing."]
 
 TRUNCATE_LINES = Annotated[int, "The number of lines to truncate the file to."]
 MAX_RESULTS = Annotated[int, "The maximum number of results to return."]
@@ -33,6 +46,11 @@ EXCLUDE_TYPES = Annotated[
 ]
 
 GET_FILES_LIMIT = 20
+FILE_LIST_CACHE_SIZE = 32
+SEARCH_BATCH_LIMIT = 20
+SEARCH_MATCHES_PER_FILE = 3
+SEARCH_CONTEXT_LINES = 4
+LIST_DIRECTORY_MAX_DEPTH = 10
 
 EXCLUDE_BINARY_TYPES: list[RIPGREP_TYPE_LIST] = [
     "avro",
@@ -62,6 +80,11 @@ EXCLUDE_EXTRA_TYPES: list[RIPGREP_TYPE_LIST] = [
 
 DEFAULT_EXCLUDED_TYPES: list[str] = sorted(EXCLUDE_BINARY_TYPES + EXCLUDE_EXTRA_TYPES)
 
+RIPGREP_TYPES: tuple[RIPGREP_TYPE_LIST, ...] = get_args(RIPGREP_TYPE_LIST)
+RIPGREP_TYPE_SET: frozenset[str] = frozenset(RIPGREP_TYPES)
+
+RipGrepFilters = tuple[tuple[str, ...], tuple[str, ...], tuple[RIPGREP_TYPE_LIST, ...], tuple[RIPGREP_TYPE_LIST, ...]]
+
 
 class RepositoryServerError(Exception):
     """Exception raised when a repository server error occurs."""
@@ -91,6 +114,13 @@ class FileMissingError(Exception):
         super().__init__(f"File {path} not found in repository {owner}/{repo}")
 
 
+class DirectoryMissingError(Exception):
+    """Exception raised when a directory is not found in a repository."""
+
+    def __init__(self, owner: str, repo: str, path: str):
+        super().__init__(f"Directory {path} not found in repository {owner}/{repo}")
+
+
 # class FileLines(RootModel[dict[int, str]]):
 #     """Lines of a file."""
 
@@ -117,11 +147,11 @@ class FileLines(RootModel[dict[int, str]]):
         return list(self.root.keys())
 
     def first(self, count: int) -> "FileLines":
-        return FileLines(root=dict(list(self.root.items())[:count]))
+        return FileLines.model_construct(root=dict(list(self.root.items())[:count]))
 
     @classmethod
     def from_text(cls, text: str) -> "FileLines":
-        return cls(root=dict(enumerate(text.splitlines(keepends=False))))
+        return cls.model_construct(root=dict(enumerate(text.splitlines(keepends=False))))
 
 
 class BaseGitHubFile(BaseModel):
@@ -171,7 +201,7 @@ class File(BaseGitHubFile):
         if should_truncate and truncate_lines is not None:
             file_lines = file_lines.first(count=truncate_lines)
 
-        return File(
+        return File.model_construct(
             # owner=owner,
             # repo=repo,
             # branch=branch,
@@ -196,57 +226,172 @@ class FileWithMatches(BaseGitHubFile):
 
     matches: list[FileEntryMatch]
 
+    @classmethod
+    def from_matches(cls, url: AnyHttpUrl, matches: list[FileEntryMatch]) -> "FileWithMatches":
+        return cls.model_construct(url=url, matches=matches)
+
+
+class QueryFileWithMatches(FileWithMatches):
+    """A file with matches, tagged with the name of the query that produced them."""
+
+    query: str
+
+    @classmethod
+    def from_query_matches(cls, query: str, url: AnyHttpUrl, matches: list[FileEntryMatch]) -> "QueryFileWithMatches":
+        return cls.model_construct(query=query, url=url, matches=matches)
+
+
+class SearchQuery(BaseModel):
+    """A named code search, run as part of a batch."""
+
+    name: str = Field(description="The name of the query. Matches are tagged with the name of the query that produced them.")
+    patterns: PATTERNS
+    include_globs: INCLUDE_GLOBS | None = None
+    exclude_globs: EXCLUDE_GLOBS | None = None
+    include_types: INCLUDE_TYPES | None = None
+    exclude_types: EXCLUDE_TYPES | None = None
+    max_results: MAX_RESULTS = 30
+
+    def filters(self) -> RipGrepFilters:
+        """Queries with the same filters search the same set of files and can share a single ripgrep scan."""
+
+        return normalize_ripgrep_filters(
+            included_globs=self.include_globs,
+            excluded_globs=self.exclude_globs,
+            included_types=self.include_types,
+            excluded_types=self.exclude_types,
+        )
+
+
+# POSIX classes and nested or set-operation character classes compile in Python but mean something else than in ripgrep
+RIPGREP_ONLY_SYNTAX: re.Pattern[str] = re.compile(r"\[\[:|\[[^\]]*(?:\[|&&|--|~~)")
+
+# Lookarounds, backreferences, atomic groups and possessive repetitions make ripgrep's hybrid mode switch to PCRE2
+PCRE2_SYNTAX: re.Pattern[str] = re.compile(r"\(\?<?[=!]|\\[1-9]|\\k[<{']|\(\?>|[*+?}]\+")
+
+
+def needs_pcre2(patterns: list[str]) -> bool:
+    """Whether ripgrep's hybrid mode would search the patterns with PCRE2.
+
+    The engine is picked once for all of the patterns of a search, so such patterns would change the meaning of the
+    patterns they share a search with.
+    """
+    return any(PCRE2_SYNTAX.search(pattern) for pattern in patterns)
+
+
+def compile_query_patterns(patterns: list[str]) -> list[re.Pattern[str]] | None:
+    """Compile the patterns of a query to attribute matches from a shared search back to it.
+
+    Returns None if a pattern uses syntax that Python does not support, or is known to mean something else in Python, in
+    which case the query must be searched on its own. Other differences are caught when attributing the matches.
+    """
+    if any(RIPGREP_ONLY_SYNTAX.search(pattern) for pattern in patterns):
+        return None
+
+    try:
+        return [re.compile(pattern, flags=re.IGNORECASE) for pattern in patterns]
+    except re.error:
+        return None
+
 
 def search_result_to_file_entry_matches(
     search_result: RipGrepSearchResult, before_context: int, after_context: int
 ) -> list[FileEntryMatch]:
-    line_context_by_line_number: dict[int, RipGrepContext] = {context.data.line_number: context for context in search_result.context}
+    """Convert a ripgrep search result into file entry matches.
+
+    This runs for every match of every search, so the models are built with `model_construct` from data we assembled
+    ourselves instead of being re-validated.
+    """
+    return lines_to_file_entry_matches(
+        match_lines=[(line_match.data.line_number, line_match.data.lines.text) for line_match in search_result.matches],
+        context_lines={context.data.line_number: context.data.lines.text for context in search_result.context},
+        before_context=before_context,
+        after_context=after_context,
+    )
+
+
+def query_match_line_numbers(search_result: RipGrepSearchResult, patterns: list[re.Pattern[str]]) -> list[int]:
+    """Get the numbers of the lines matched by ripgrep that match one of the patterns of a query."""
+
+    return [
+        line_match.data.line_number
+        for line_match in search_result.matches
+        if (text := line_match.data.lines.text) and any(pattern.search(text.removesuffix("\n")) for pattern in patterns)
+    ]
+
+
+def search_result_to_query_file_entry_matches(
+    search_result: RipGrepSearchResult, query_line_numbers: list[int], max_count: int, before_context: int, after_context: int
+) -> list[FileEntryMatch]:
+    """Rebuild the file entry matches a query would get on its own from a search shared with other queries.
+
+    The shared search has no per-file match limit, so ripgrep's `--max-count` behavior is applied per query here: the first
+    `max_count` of the lines matching the query (`query_line_numbers`) are matches, lines matching the query within the
+    after context of the last of those are still reported as matches, nothing past that after context is reported, and
+    every other line (including lines only matched by other queries) is context.
+    """
+    lines: dict[int, str | None] = {context.data.line_number: context.data.lines.text for context in search_result.context}
+    lines.update({line_match.data.line_number: line_match.data.lines.text for line_match in search_result.matches})
+
+    if not query_line_numbers:
+        return []
+
+    last_line_number: int = query_line_numbers[:max_count][-1] + after_context
+
+    match_line_numbers: list[int] = [
+        line_number for index, line_number in enumerate(query_line_numbers) if index < max_count or line_number <= last_line_number
+    ]
+
+    return lines_to_file_entry_matches(
+        match_lines=[(line_number, lines.pop(line_number)) for line_number in match_line_numbers],
+        context_lines={line_number: text for line_number, text in lines.items() if line_number <= last_line_number},
+        before_context=before_context,
+        after_context=after_context,
+    )
 
+
+def lines_to_file_entry_matches(
+    match_lines: list[tuple[int, str | None]], context_lines: dict[int, str | None], before_context: int, after_context: int
+) -> list[FileEntryMatch]:
     file_entry_matches: list[FileEntryMatch] = []
 
-    for line_match in search_result.matches:
-        if not line_match.data.lines.text:
+    for match_line_number, match_text in match_lines:
+        if not match_text:
             continue
 
-        before_context_lines: FileLines = FileLines(root={})
-        after_context_lines: FileLines = FileLines(root={})
+        before_context_lines: dict[int, str] = {}
+        after_context_lines: dict[int, str] = {}
 
         # Find the before context lines
-        for line_number in range(line_match.data.line_number - before_context, line_match.data.line_number):
-            if line := line_context_by_line_number.pop(line_number, None):  # noqa: SIM102
-                if text := line.data.lines.text:  # noqa: SIM102
-                    if stripped_line := text.rstrip():
-                        before_context_lines.root[line_number] = stripped_line
+        for line_number in range(match_line_number - before_context, match_line_number):
+            if text := context_lines.pop(line_number, None):  # noqa: SIM102
+                if stripped_line := text.rstrip():
+                    before_context_lines[line_number] = stripped_line
 
         # Find the after context lines
-        for line_number in range(line_match.data.line_number + 1, line_match.data.line_number + after_context + 1):
-            if line := line_context_by_line_number.pop(line_number, None):  # noqa: SIM102
-                if text := line.data.lines.text:  # noqa: SIM102
-                    if stripped_line := text.rstrip():
-                        after_context_lines.root[line_number] = stripped_line
+        for line_number in range(match_line_number + 1, match_line_number + after_context + 1):
+            if text := context_lines.pop(line_number, None):  # noqa: SIM102
+                if stripped_line := text.rstrip():
+                    after_context_lines[line_number] = stripped_line
 
         file_entry_matches.append(
-            FileEntryMatch(
-                before=before_context_lines,
-                match=FileLines(root={line_match.data.line_number: line_match.data.lines.text.rstrip()}),
-                after=after_context_lines,
+            FileEntryMatch.model_construct(
+                before=FileLines.model_construct(root=before_context_lines),
+                match=FileLines.model_construct(root={match_line_number: match_text.rstrip()}),
+                after=FileLines.model_construct(root=after_context_lines),
             )
         )
 
     return file_entry_matches
 
 
-def prepare_ripgrep_arguments(
-    included_globs: list[str] | None,
-    excluded_globs: list[str] | None,
+def normalize_ripgrep_filters(
+    included_globs: list[str] | str | None,
+    excluded_globs: list[str] | str | None,
     included_types: list[str] | None,
     excluded_types: list[str] | None,
-) -> tuple[list[str], list[str], list[RIPGREP_TYPE_LIST], list[RIPGREP_TYPE_LIST]]:
-    if included_globs is None:
-        included_globs = []
-
-    if excluded_globs is None:
-        excluded_globs = []
+) -> RipGrepFilters:
+    """Normalize the filter arguments of a search into a hashable key, applying the default excluded types."""
 
     if isinstance(included_globs, str):
         included_globs = [included_globs]
@@ -254,16 +399,44 @@ def prepare_ripgrep_arguments(
     if isinstance(excluded_globs, str):
         excluded_globs = [excluded_globs]
 
-    included_type_list: list[RIPGREP_TYPE_LIST] = []
-    excluded_type_list: list[RIPGREP_TYPE_LIST] = []
+    if excluded_types is None:
+        excluded_types = DEFAULT_EXCLUDED_TYPES
 
-    if included_types:
-        included_type_list = [t for t in included_types if t in get_args(RIPGREP_TYPE_LIST)]  # pyright: ignore[reportAssignmentType]
+    return _normalize_ripgrep_filters(
+        included_globs=tuple(included_globs or ()),
+        excluded_globs=tuple(excluded_globs or ()),
+        included_types=tuple(included_types or ()),
+        excluded_types=tuple(excluded_types),
+    )
 
-    if excluded_types:
-        excluded_type_list = [t for t in excluded_types if t in get_args(RIPGREP_TYPE_LIST)]  # pyright: ignore[reportAssignmentType]
 
-    return included_globs, excluded_globs, included_type_list, excluded_type_list
+@lru_cache(maxsize=256)
+def _normalize_ripgrep_filters(
+    included_globs: tuple[str, ...],
+    excluded_globs: tuple[str, ...],
+    included_types: tuple[str, ...],
+    excluded_types: tuple[str, ...],
+) -> RipGrepFilters:
+    return (
+        # Later globs override earlier ones in ripgrep, so globs keep their order and only repeats are dropped
+        tuple(dict.fromkeys(included_globs)),
+        tuple(dict.fromkeys(excluded_globs)),
+        tuple(sorted({t for t in included_types if t in RIPGREP_TYPE_SET})),  # pyright: ignore[reportReturnType]
+        tuple(sorted({t for t in excluded_types if t in RIPGREP_TYPE_SET})),  # pyright: ignore[reportReturnType]
+    )
+
+
+def prepare_ripgrep_arguments(
+    included_globs: list[str] | None,
+    excluded_globs: list[str] | None,
+    included_types: list[str] | None,
+    excluded_types: list[str] | None,
+) -> tuple[list[str], list[str], list[RIPGREP_TYPE_LIST], list[RIPGREP_TYPE_LIST]]:
+    included_globs_tuple, excluded_globs_tuple, included_type_tuple, excluded_type_tuple = normalize_ripgrep_filters(
+        included_globs=included_globs, excluded_globs=excluded_globs, included_types=included_types, excluded_types=excluded_types
+    )
+
+    return list(included_globs_tuple), list(excluded_globs_tuple), list(included_type_tuple), list(excluded_type_tuple)
 
 
 class Directory(BaseModel):
@@ -274,8 +447,61 @@ class Directory(BaseModel):
     branch: str
     path: str
     url: AnyHttpUrl
-    files: list[str]
-    directories: list[str]
+    files: list[str] = Field(description="The paths of the files in the directory, relative to the root of the repository.")
+    directories: list[str] = Field(description="The paths of the subdirectories in the directory, relative to the root of the repository.")
+    file_sizes: dict[str, int] | None = Field(default=None, description="The size (in bytes) of each file, keyed by path.")
+
+
+@dataclass(slots=True)
+class GitTreeNode:
+    """A node in the in-memory trie built from the git tree objects of a repository."""
+
+    size: int | None = None
+    children: dict[str, "GitTreeNode"] | None = None
+
+
+@dataclass(slots=True)
+class GitTree:
+    """The git tree of a repository, parsed once into a trie of directories and files."""
+
+    root: GitTreeNode = field(default_factory=lambda: GitTreeNode(children={}))
+
+    @classmethod
+    def from_ls_tree(cls, ls_tree_output: str) -> "GitTree":
+        """Build the trie from the NUL-separated output of `git ls-tree -r -t -l -z`."""
+
+        git_tree: GitTree = cls()
+
+        for entry in ls_tree_output.split("\0"):
+            if not entry:
+                continue
+
+            metadata, _, path = entry.partition("\t")
+            _mode, object_type, _object_name, size = metadata.split(maxsplit=3)
+
+            node: GitTreeNode = git_tree.root
+            *parents, name = path.split("/")
+
+            for parent in parents:
+                node = node.children.setdefault(parent, GitTreeNode(children={}))  # pyright: ignore[reportOptionalMemberAccess]
+
+            if object_type == "blob":
+                node.children[name] = GitTreeNode(size=int(size))  # pyright: ignore[reportOptionalSubscript]
+            else:
+                # Trees and submodules (commits) are both presented as directories
+                _ = node.children.setdefault(name, GitTreeNode(children={}))  # pyright: ignore[reportOptionalMemberAccess]
+
+        return git_tree
+
+    def get(self, path: str) -> GitTreeNode | None:
+        node: GitTreeNode = self.root
+
+        for part in path.split("/") if path else []:
+            if node.children is None or (child := node.children.get(part)) is None:
+                return None
+            node = child
+
+        return node
 
 
 class LocalRepository(BaseModel):
@@ -287,18 +513,35 @@ class LocalRepository(BaseModel):
 
     local_path: Path
 
+    head_commit: str
+
+    _git_tree: GitTree | None = PrivateAttr(default=None)
+    _git_tree_lock: asyncio.Lock = PrivateAttr(default_factory=asyncio.Lock)
+
+    _file_list_cache: dict[RipGrepFilters, list[str]] = PrivateAttr(default_factory=dict)
+    _file_list_walks: dict[RipGrepFilters, asyncio.Task[None]] = PrivateAttr(default_factory=dict)
+    _file_list_misses: dict[RipGrepFilters, None] = PrivateAttr(default_factory=dict)
+
+    _file_url_cache: dict[str, AnyHttpUrl] = PrivateAttr(default_factory=dict)
+
     @field_validator("local_path")
     @classmethod
     def validate_local_path(cls, local_path: Path) -> Path:
         return local_path.resolve()
 
     async def get_file(self, path: str, truncate_lines: TRUNCATE_LINES | None = None) -> File:
-        file_path: Path = self.validate_file_path(path)
+        return await self.read_file(path=path, file_path=self.validate_file_path(path), truncate_lines=truncate_lines)
+
+    async def read_file(self, path: str, file_path: Path, truncate_lines: TRUNCATE_LINES | None = None) -> File:
+        """Read a file that has already been checked with `validate_file_path`.
+
+        The url is built from the requested path rather than the resolved one, as resolving follows symlinks.
+        """
 
         async with await open_file(file=file_path) as file:
             file_text: str = await file.read()
 
-        url: AnyHttpUrl = self.generate_file_url(path)
+        url: AnyHttpUrl = self.generate_file_url(posixpath.normpath(path))
 
         return File.from_text(
             # owner=self.owner,
@@ -321,20 +564,271 @@ class LocalRepository(BaseModel):
 
         return file_path
 
+    def normalize_directory_path(self, path: str) -> str:
+        parts: list[str] = [part for part in path.strip().split("/") if part and part != "."]
+
+        if ".." in parts:
+            raise InvalidFilePathError(owner=self.owner, repo=self.repo, path=path)
+
+        return "/".join(parts)
+
+    def _read_git_tree(self) -> GitTree:
+        ls_tree_output: str = Repo(self.local_path).git.ls_tree("-r", "-t", "-l", "-z", "HEAD")
+
+        return GitTree.from_ls_tree(ls_tree_output)
+
+    async def get_git_tree(self) -> GitTree:
+        """Get the git tree of the checked out HEAD, reading and parsing it only once."""
+
+        if self._git_tree is not None:
+            return self._git_tree
+
+        async with self._git_tree_lock:
+            if self._git_tree is None:
+                self._git_tree = await asyncio.to_thread(self._read_git_tree)
+
+        return self._git_tree
+
+    async def list_directory(self, path: str = "", depth: DEPTH = 1, include_sizes: INCLUDE_SIZES = False) -> Directory:
+        directory_path: str = self.normalize_directory_path(path)
+
+        git_tree: GitTree = await self.get_git_tree()
+
+        node: GitTreeNode | None = git_tree.get(directory_path)
+
+        if node is None or node.children is None:
+            raise DirectoryMissingError(owner=self.owner, repo=self.repo, path=path)
+
+        files: list[str] = []
+        directories: list[str] = []
+        file_sizes: dict[str, int] = {}
+
+        def walk(prefix: str, children: dict[str, GitTreeNode], remaining_depth: int) -> None:
+            for name, child in children.items():
+                child_path: str = f"{prefix}/{name}" if prefix else name
+
+                if child.children is None:
+                    files.append(child_path)
+                    if include_sizes and child.size is not None:
+                        file_sizes[child_path] = child.size
+                    continue
+
+                directories.append(child_path)
+
+                if remaining_depth > 1:
+                    walk(prefix=child_path, children=child.children, remaining_depth=remaining_depth - 1)
+
+        walk(prefix=directory_path, children=node.children, remaining_depth=min(max(depth, 1), LIST_DIRECTORY_MAX_DEPTH))
+
+        return Directory(
+            owner=self.owner,
+            repo=self.repo,
+            branch=self.branch,
+            path=directory_path,
+            url=self.generate_tree_url(directory_path),
+            files=files,
+            directories=directories,
+            file_sizes=file_sizes if include_sizes else None,
+        )
+
+    def generate_tree_url(self, path: str) -> AnyHttpUrl:
+        tree_url: str = f"https://github.com/{self.owner}/{self.repo}/tree/{self.branch}"
+        return AnyHttpUrl(f"{tree_url}/{path}" if path else tree_url)
+
+    @cached_property
+    def blob_url_prefix(self) -> str:
+        return f"https://github.com/{self.owner}/{self.repo}/blob/{self.branch}/"
+
     def generate_blob_url(self) -> AnyHttpUrl:
-        return AnyHttpUrl(f"https://github.com/{self.owner}/{self.repo}/blob/{self.branch}")
+        return AnyHttpUrl(self.blob_url_prefix.rstrip("/"))
 
     def generate_file_url(self, path: str) -> AnyHttpUrl:
-        return AnyHttpUrl(f"{self.generate_blob_url()}/{path}")
+        """Generate the URL of a file on GitHub.
+
+        An `AnyHttpUrl` can't be created without validating it, so the URL of each path is validated once and reused by
+        later searches that return the same file.
+        """
+        if (file_url := self._file_url_cache.get(path)) is None:
+            file_url = self._file_url_cache[path] = AnyHttpUrl(self.blob_url_prefix + path)
+
+        return file_url
 
     @property
     def search_builder(self) -> RipGrepSearch:
         return RipGrepSearch(working_directory=self.local_path).add_safe_defaults()
 
+    def code_search(
+        self,
+        *,
+        patterns: PATTERNS,
+        include_globs: INCLUDE_GLOBS | None = None,
+        exclude_globs: EXCLUDE_GLOBS | None = None,
+        include_types: INCLUDE_TYPES | None = None,
+        exclude_types: EXCLUDE_TYPES | None = None,
+        max_count: int | None = SEARCH_MATCHES_PER_FILE,
+    ) -> RipGrepSearch:
+        included_globs_list, excluded_globs_list, included_type_list, excluded_type_list = prepare_ripgrep_arguments(
+            included_globs=include_globs, excluded_globs=exclude_globs, included_types=include_types, excluded_types=exclude_types
+        )
+
+        ripgrep: RipGrepSearch = (
+            self.search_builder.auto_hybrid_regex()
+            .include_globs(globs=included_globs_list)
+            .exclude_globs(globs=excluded_globs_list)
+            .include_types(ripgrep_types=included_type_list)
+            .exclude_types(ripgrep_types=excluded_type_list)
+            .before_context(context=SEARCH_CONTEXT_LINES)
+            .after_context(context=SEARCH_CONTEXT_LINES)
+            .add_patterns(patterns)
+            .case_sensitive(case_sensitive=False)
+        )
+
+        if max_count is not None:
+            ripgrep = ripgrep.max_count(count=max_count)  # Matches per File
+
+        return ripgrep
+
     @property
     def find_file_builder(self) -> RipGrepFind:
         return RipGrepFind(working_directory=self.local_path).add_safe_defaults()
 
+    async def find_files(
+        self,
+        include_globs: INCLUDE_GLOBS | None = None,
+        exclude_globs: EXCLUDE_GLOBS | None = None,
+        include_types: INCLUDE_TYPES | None = None,
+        exclude_types: EXCLUDE_TYPES | None = None,
+        max_results: MAX_RESULTS = 100,
+    ) -> list[str]:
+        """Find the paths of the files matching the filters.
+
+        The clone never changes once it is made, so once the tree has been fully walked for a combination of filters the
+        file list is served from memory. A walk that is stopped early at `max_results` is only finished in the background
+        when the same filters miss a second time, as one-off filters are far more common than repeated ones.
+        """
+        filters: RipGrepFilters = normalize_ripgrep_filters(
+            included_globs=include_globs, excluded_globs=exclude_globs, included_types=include_types, excluded_types=exclude_types
+        )
+
+        if (file_list := self._file_list_cache.get(filters)) is not None:
+            return file_list[:max_results]
+
+        file_list = []
+
+        async for matched_path in self._find_files_ripgrep(filters=filters).arun():
+            file_list.append(str(matched_path))
+
+            if len(file_list) >= max_results:
+                if self._record_file_list_miss(filters=filters):
+                    self._walk_file_list_in_background(filters=filters)
+
+                return file_list
+
+        self._cache_file_list(filters=filters, file_list=file_list)
+
+        return file_list
+
+    def _find_files_ripgrep(self, filters: RipGrepFilters) -> RipGrepFind:
+        included_globs, excluded_globs, included_types, excluded_types = filters
+
+        return (
+            self.find_file_builder.include_types(ripgrep_types=list(included_types))
+            .exclude_types(ripgrep_types=list(excluded_types))
+            .include_globs(list(included_globs))
+            .exclude_globs(list(excluded_globs))
+        )
+
+    def _cache_file_list(self, filters: RipGrepFilters, file_list: list[str]) -> None:
+        if len(self._file_list_cache) >= FILE_LIST_CACHE_SIZE:
+            del self._file_list_cache[next(iter(self._file_list_cache))]
+
+        self._file_list_cache[filters] = file_list
+
+    def _record_file_list_miss(self, filters: RipGrepFilters) -> bool:
+        """Record a truncated walk for the filters, returning whether they have missed before."""
+        if filters in self._file_list_misses:
+            del self._file_list_misses[filters]
+            return True
+
+        if len(self._file_list_misses) >= FILE_LIST_CACHE_SIZE:
+            del self._file_list_misses[next(iter(self._file_list_misses))]
+
+        self._file_list_misses[filters] = None
+
+        return False
+
+    def _walk_file_list_in_background(self, filters: RipGrepFilters) -> None:
+        if filters in self._file_list_walks:
+            return
+
+        async def walk_file_list() -> None:
+            self._cache_file_list(
+                filters=filters, file_list=[str(matched_path) async for matched_path in self._find_files_ripgrep(filters).arun()]
+            )
+
+        def walk_done(task: asyncio.Task[None]) -> None:
+            _ = self._file_list_walks.pop(filters, None)
+
+            # A failed walk is simply retried by the next call, retrieve the exception so it isn't reported as unhandled
+            if not task.cancelled():
+                _ = task.exception()
+
+        task: asyncio.Task[None] = asyncio.create_task(walk_file_list())
+        self._file_list_walks[filters] = task
+        task.add_done_callback(walk_done)
+
+
+T = TypeVar("T")
+
+
+@dataclass(slots=True)
+class Flight:
+    """An execution shared between the callers waiting for its result."""
+
+    task: asyncio.Task[Any]
+    waiters: int = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent identical calls, sharing the result of a single execution between all of the callers."""
+
+    def __init__(self):
+        self.in_flight: dict[tuple[str, Hashable], Flight] = {}
+        self.saved_executions: Counter[str] = Counter()
+
+    async def run(self, name: str, key: Hashable, execute: Callable[[], Coroutine[Any, Any, T]]) -> T:
+        flight_key: tuple[str, Hashable] = (name, key)
+
+        if (flight := self.in_flight.get(flight_key)) is not None:
+            self.saved_executions[name] += 1
+        else:
+            flight = self.in_flight[flight_key] = Flight(task=asyncio.create_task(execute()))
+            flight.task.add_done_callback(partial(self._flight_done, flight_key, flight))
+
+        flight.waiters += 1
+
+        try:
+            # Shield the shared execution so that one caller being cancelled doesn't cancel it for the others
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller has gone away, so stop the execution and let new callers start a fresh one
+                self._forget(flight_key, flight)
+                _ = flight.task.cancel()
+
+    def _forget(self, flight_key: tuple[str, Hashable], flight: Flight) -> None:
+        if self.in_flight.get(flight_key) is flight:
+            del self.in_flight[flight_key]
+
+    def _flight_done(self, flight_key: tuple[str, Hashable], flight: Flight, task: asyncio.Task[Any]) -> None:
+        self._forget(flight_key, flight)
+
+        # Retrieve the exception so an execution that failed after its callers left isn't reported as unhandled
+        if not task.cancelled():
+            _ = task.exception()
+
 
 class RepositoryServer:
     """Server for cloning and searching repositories."""
@@ -344,9 +838,25 @@ class RepositoryServer:
         self.logger: Logger = logger or getLogger(__name__)
         self.clone_dir: Path = clone_dir.resolve()
         self.repository_lock: asyncio.Lock = asyncio.Lock()
+        self.single_flight: SingleFlight = SingleFlight()
+
+    @property
+    def saved_executions(self) -> dict[str, int]:
+        """The number of executions saved by sharing the result of an identical in-flight call, by tool."""
+
+        return dict(self.single_flight.saved_executions)
 
-    def _add_repository(self, owner: str, repo: str, branch: str, local_path: Path) -> LocalRepository:
-        repository: LocalRepository = LocalRepository(owner=owner, repo=repo, branch=branch, local_path=local_path)
+    async def _single_flight(
+        self, name: str, repository_entry: LocalRepository, key: Hashable, execute: Callable[[], Coroutine[Any, Any, T]]
+    ) -> T:
+        """Helper function to share one execution between concurrent identical calls against the same repository HEAD."""
+
+        return await self.single_flight.run(
+            name=name, key=(repository_entry.owner, repository_entry.repo, repository_entry.head_commit, key), execute=execute
+        )
+
+    def _add_repository(self, owner: str, repo: str, branch: str, head_commit: str, local_path: Path) -> LocalRepository:
+        repository: LocalRepository = LocalRepository(owner=owner, repo=repo, branch=branch, head_commit=head_commit, local_path=local_path)
         self.repositories[f"{owner}/{repo}"] = repository
         return repository
 
@@ -357,7 +867,9 @@ class RepositoryServer:
         _ = mcp.add_tool(tool=Tool.from_function(fn=self.get_file))
         _ = mcp.add_tool(tool=Tool.from_function(fn=self.get_files))
         _ = mcp.add_tool(tool=Tool.from_function(fn=self.find_files))
+        _ = mcp.add_tool(tool=Tool.from_function(fn=self.list_directory))
         _ = mcp.add_tool(tool=Tool.from_function(fn=self.search_code))
+        _ = mcp.add_tool(tool=Tool.from_function(fn=self.search_code_batch))
         _ = mcp.add_tool(tool=Tool.from_function(fn=self.get_file_types_for_search))
 
     async def _get_file(self, repository_entry: LocalRepository, path: str, truncate_lines: TRUNCATE_LINES = 100) -> File:
@@ -384,7 +896,7 @@ class RepositoryServer:
         """Get the list of file types that can be used in the `include_types` and `exclude_types` arguments of a
         code search or find files."""
 
-        return list[str](get_args(tp=RIPGREP_TYPE_LIST))
+        return list[str](RIPGREP_TYPES)
 
     async def get_file(
         self,
@@ -396,7 +908,19 @@ class RepositoryServer:
         """Get a file from the main branch of a repository."""
         repository_entry: LocalRepository = await self._prepare_repository(owner, repo)
 
-        return await repository_entry.get_file(path=path, truncate_lines=truncate_lines)
+        return await self._coalesced_get_file(repository_entry=repository_entry, path=path, truncate_lines=truncate_lines)
+
+    async def _coalesced_get_file(self, repository_entry: LocalRepository, path: str, truncate_lines: TRUNCATE_LINES) -> File:
+        """Helper function to get a file from a repository, sharing the read with identical in-flight calls."""
+
+        file_path: Path = repository_entry.validate_file_path(path)
+
+        return await self._single_flight(
+            name="get_file",
+            repository_entry=repository_entry,
+            key=(str(file_path), posixpath.normpath(path), truncate_lines),
+            execute=lambda: repository_entry.read_file(path=path, file_path=file_path, truncate_lines=truncate_lines),
+        )
 
     async def get_files(
         self,
@@ -412,7 +936,9 @@ class RepositoryServer:
             msg = f"Cannot get more than {GET_FILES_LIMIT} files from a repository."
             raise ValueError(msg)
 
-        return [await repository_entry.get_file(path=path, truncate_lines=truncate_lines) for path in paths]
+        return [
+            await self._coalesced_get_file(repository_entry=repository_entry, path=path, truncate_lines=truncate_lines) for path in paths
+        ]
 
     async def find_files(
         self,
@@ -428,28 +954,42 @@ class RepositoryServer:
 
         repository_entry: LocalRepository = await self._prepare_repository(owner=owner, repo=repo)
 
-        included_globs_list, excluded_globs_list, included_type_list, excluded_type_list = prepare_ripgrep_arguments(
-            included_globs=include_globs, excluded_globs=exclude_globs, included_types=include_types, excluded_types=exclude_types
+        file_list: list[str] = await self._single_flight(
+            name="find_files",
+            repository_entry=repository_entry,
+            key=(
+                normalize_ripgrep_filters(
+                    included_globs=include_globs, excluded_globs=exclude_globs, included_types=include_types, excluded_types=exclude_types
+                ),
+                max_results,
+            ),
+            execute=lambda: repository_entry.find_files(
+                include_globs=include_globs,
+                exclude_globs=exclude_globs,
+                include_types=include_types,
+                exclude_types=exclude_types,
+                max_results=max_results,
+            ),
         )
 
-        ripgrep = (
-            repository_entry.find_file_builder.include_types(ripgrep_types=included_type_list)
-            .exclude_types(ripgrep_types=excluded_type_list)
-            .include_globs(included_globs_list)
-            .exclude_globs(excluded_globs_list)
-        )
-
-        results: list[BasicFileInfo] = []
-
-        async for matched_path in ripgrep.arun():
-            file_entry: BasicFileInfo = BasicFileInfo(path=str(matched_path))
+        return [BasicFileInfo.model_construct(path=path) for path in file_list]
 
-            results.append(file_entry)
-
-            if len(results) >= max_results:
-                break
+    async def list_directory(
+        self,
+        owner: OWNER,
+        repo: REPO,
+        path: DIRECTORY_PATH = "",
+        depth: DEPTH = 1,
+        include_sizes: INCLUDE_SIZES = False,
+    ) -> Directory:
+        """List the files and subdirectories of a directory in the repository.
+
+        Set `depth` to list subdirectories recursively (up to 10 levels) in a single call, and `include_sizes` to
+        get the size of each file. Paths are relative to the root of the repository.
+        """
+        repository_entry: LocalRepository = await self._prepare_repository(owner=owner, repo=repo)
 
-        return results
+        return await repository_entry.list_directory(path=path, depth=depth, include_sizes=include_sizes)
 
     async def search_code(
         self,
@@ -472,21 +1012,44 @@ class RepositoryServer:
         """
         repository_entry: LocalRepository = await self._prepare_repository(owner=owner, repo=repo)
 
-        included_globs_list, excluded_globs_list, included_type_list, excluded_type_list = prepare_ripgrep_arguments(
+        filters: RipGrepFilters = normalize_ripgrep_filters(
             included_globs=include_globs, excluded_globs=exclude_globs, included_types=include_types, excluded_types=exclude_types
         )
 
-        ripgrep: RipGrepSearch = (
-            repository_entry.search_builder.auto_hybrid_regex()
-            .include_globs(globs=included_globs_list)
-            .exclude_globs(globs=excluded_globs_list)
-            .include_types(ripgrep_types=included_type_list)
-            .exclude_types(ripgrep_types=excluded_type_list)
-            .before_context(context=4)
-            .after_context(context=4)
-            .add_patterns(patterns)
-            .max_count(count=3)  # Matches per File
-            .case_sensitive(case_sensitive=False)
+        return await self._single_flight(
+            name="search_code",
+            repository_entry=repository_entry,
+            key=(tuple(patterns), filters, max_results),
+            execute=lambda: self._search_code(
+                repository_entry=repository_entry,
+                patterns=patterns,
+                include_globs=include_globs,
+                exclude_globs=exclude_globs,
+                include_types=include_types,
+                exclude_types=exclude_types,
+                max_results=max_results,
+            ),
+        )
+
+    async def _search_code(
+        self,
+        *,
+        repository_entry: LocalRepository,
+        patterns: PATTERNS,
+        include_globs: INCLUDE_GLOBS | None,
+        exclude_globs: EXCLUDE_GLOBS | None,
+        include_types: INCLUDE_TYPES | None,
+        exclude_types: EXCLUDE_TYPES | None,
+        max_results: MAX_RESULTS,
+    ) -> list[FileWithMatches]:
+        """Helper function to search the code in a repository."""
+
+        ripgrep: RipGrepSearch = repository_entry.code_search(
+            patterns=patterns,
+            include_globs=include_globs,
+            exclude_globs=exclude_globs,
+            include_types=include_types,
+            exclude_types=exclude_types,
         )
 
         results: list[FileWithMatches] = []
@@ -495,17 +1058,10 @@ class RepositoryServer:
             url: AnyHttpUrl = repository_entry.generate_file_url(path=str(result.path))
 
             file_entry_matches: list[FileEntryMatch] = search_result_to_file_entry_matches(
-                search_result=result, before_context=4, after_context=4
+                search_result=result, before_context=SEARCH_CONTEXT_LINES, after_context=SEARCH_CONTEXT_LINES
             )
 
-            file_with_matches: FileWithMatches = FileWithMatches(
-                # owner=owner,
-                # repo=repo,
-                # branch=repository_entry.branch,
-                # path=str(result.path),
-                url=url,
-                matches=file_entry_matches,
-            )
+            file_with_matches: FileWithMatches = FileWithMatches.from_matches(url=url, matches=file_entry_matches)
 
             results.append(file_with_matches)
 
@@ -514,7 +1070,169 @@ class RepositoryServer:
 
         return results
 
-    def _clone_repository(self, owner: str, repo: str, directory: Path) -> str:
+    async def search_code_batch(
+        self,
+        owner: OWNER,
+        repo: REPO,
+        queries: list[SearchQuery],
+    ) -> list[QueryFileWithMatches]:
+        """Run multiple named code searches against the default branch of the repository at once (up to 20 queries).
+
+        Each query has its own patterns, globs, types and max_results, and every result is tagged with the name of the
+        query that produced it. Queries with the same globs and types share a single scan of the repository, so prefer
+        one batch over many `search_code` calls. Each query gets the same matches and context as it would from
+        `search_code`. Queries that need PCRE2 (lookarounds, backreferences) run as a scan of their own, and so do the
+        queries of a shared scan whose matches can't be attributed reliably.
+        """
+        repository_entry: LocalRepository = await self._prepare_repository(owner=owner, repo=repo)
+
+        if len(queries) > SEARCH_BATCH_LIMIT:
+            msg = f"Cannot run more than {SEARCH_BATCH_LIMIT} queries in a batch."
+            raise ValueError(msg)
+
+        if len({query.name for query in queries}) != len(queries):
+            msg = "Query names must be unique within a batch."
+            raise ValueError(msg)
+
+        return await self._single_flight(
+            name="search_code_batch",
+            repository_entry=repository_entry,
+            key=tuple((query.name, tuple(query.patterns), query.filters(), query.max_results) for query in queries),
+            execute=lambda: self._search_code_batch(repository_entry=repository_entry, queries=queries),
+        )
+
+    async def _search_code_batch(self, repository_entry: LocalRepository, queries: list[SearchQuery]) -> list[QueryFileWithMatches]:
+        """Helper function to run a batch of queries, sharing a ripgrep scan between queries with the same filters."""
+
+        shared_groups: dict[RipGrepFilters, list[SearchQuery]] = {}
+        own_groups: list[tuple[RipGrepFilters, list[SearchQuery]]] = []
+
+        for query in queries:
+            if needs_pcre2(query.patterns) or compile_query_patterns(query.patterns) is None:
+                # Sharing would change the regex engine of the other queries, or matches can't be attributed back to this
+                # query, so it gets a scan of its own
+                own_groups.append((query.filters(), [query]))
+                continue
+
+            shared_groups.setdefault(query.filters(), []).append(query)
+
+        group_results: list[dict[str, list[QueryFileWithMatches]]] = await asyncio.gather(
+            *[
+                self._search_query_group(repository_entry=repository_entry, filters=filters, queries=group)
+                for filters, group in [*shared_groups.items(), *own_groups]
+            ]
+        )
+
+        results_by_query: dict[str, list[QueryFileWithMatches]] = {
+            name: query_results for group_result in group_results for name, query_results in group_result.items()
+        }
+
+        return [result for query in queries for result in results_by_query[query.name]]
+
+    async def _search_query_group(
+        self, repository_entry: LocalRepository, filters: RipGrepFilters, queries: list[SearchQuery]
+    ) -> dict[str, list[QueryFileWithMatches]]:
+        """Helper function to run queries with the same filters as a single search, attributing each match to its queries."""
+
+        if len(queries) == 1:
+            return await self._search_query(repository_entry=repository_entry, filters=filters, query=queries[0])
+
+        # A per-file match limit would be shared between all of the queries, so shared searches run without one
+        ripgrep: RipGrepSearch = self._query_group_search(
+            repository_entry=repository_entry, filters=filters, queries=queries, max_count=None
+        )
+
+        query_patterns: dict[str, list[re.Pattern[str]]] = {
+            query.name: patterns for query in queries if (patterns := compile_query_patterns(query.patterns)) is not None
+        }
+
+        results: dict[str, list[QueryFileWithMatches]] = {query.name: [] for query in queries}
+
+        async for result in ripgrep.arun():
+            pending_queries: list[SearchQuery] = [query for query in queries if len(results[query.name]) < query.max_results]
+
+            if not pending_queries:
+                break
+
+            query_line_numbers: dict[str, list[int]] = {
+                query.name: query_match_line_numbers(search_result=result, patterns=query_patterns[query.name]) for query in queries
+            }
+
+            attributed_line_numbers: set[int] = {
+                line_number for line_numbers in query_line_numbers.values() for line_number in line_numbers
+            }
+
+            if any(
+                line_match.data.lines.text and line_match.data.line_number not in attributed_line_numbers for line_match in result.matches
+            ):
+                # A pattern means something else in ripgrep than in Python, so the matches can't be attributed reliably
+                self.logger.debug(f"Could not attribute the matches of a shared search in {result.path}, searching queries on their own")
+
+                query_results: list[dict[str, list[QueryFileWithMatches]]] = await asyncio.gather(
+                    *[self._search_query(repository_entry=repository_entry, filters=filters, query=query) for query in queries]
+                )
+
+                return {name: query_files for query_result in query_results for name, query_files in query_result.items()}
+
+            url: AnyHttpUrl = repository_entry.generate_file_url(path=str(result.path))
+
+            for query in pending_queries:
+                query_matches: list[FileEntryMatch] = search_result_to_query_file_entry_matches(
+                    search_result=result,
+                    query_line_numbers=query_line_numbers[query.name],
+                    max_count=SEARCH_MATCHES_PER_FILE,
+                    before_context=SEARCH_CONTEXT_LINES,
+                    after_context=SEARCH_CONTEXT_LINES,
+                )
+
+                if query_matches:
+                    results[query.name].append(QueryFileWithMatches.from_query_matches(query=query.name, url=url, matches=query_matches))
+
+        return results
+
+    async def _search_query(
+        self, repository_entry: LocalRepository, filters: RipGrepFilters, query: SearchQuery
+    ) -> dict[str, list[QueryFileWithMatches]]:
+        """Helper function to run a query of a batch as a search of its own."""
+
+        ripgrep: RipGrepSearch = self._query_group_search(
+            repository_entry=repository_entry, filters=filters, queries=[query], max_count=SEARCH_MATCHES_PER_FILE
+        )
+
+        results: list[QueryFileWithMatches] = []
+
+        async for result in ripgrep.arun():
+            file_entry_matches: list[FileEntryMatch] = search_result_to_file_entry_matches(
+                search_result=result, before_context=SEARCH_CONTEXT_LINES, after_context=SEARCH_CONTEXT_LINES
+            )
+
+            url: AnyHttpUrl = repository_entry.generate_file_url(path=str(result.path))
+
+            if file_entry_matches:
+                results.append(QueryFileWithMatches.from_query_matches(query=query.name, url=url, matches=file_entry_matches))
+
+            if len(results) >= query.max_results:
+                break
+
+        return {query.name: results}
+
+    def _query_group_search(
+        self, repository_entry: LocalRepository, filters: RipGrepFilters, queries: list[SearchQuery], max_count: int | None
+    ) -> RipGrepSearch:
+        included_globs, excluded_globs, included_types, excluded_types = filters
+
+        return repository_entry.code_search(
+            patterns=[pattern for query in queries for pattern in query.patterns],
+            include_globs=list(included_globs),
+            exclude_globs=list(excluded_globs),
+            include_types=list[str](included_types),
+            exclude_types=list[str](excluded_types),
+            max_count=max_count,
+        )
+
+    def _clone_repository(self, owner: str, repo: str, directory: Path) -> tuple[str, str]:
+        """Clone the repository, returning the name of its branch and the commit it is checked out at."""
+
         try:
             repository: Repo = Repo.clone_from(
                 f"https://github.com/{owner}/{repo}.git",
@@ -527,7 +1245,7 @@ class RepositoryServer:
             msg = f"Error preparing repository {owner}/{repo}: {e}"
             raise RepositoryServerError(msg) from e
 
-        return repository.active_branch.name
+        return repository.active_branch.name, repository.head.commit.hexsha
 
     async def _prepare_repository(self, owner: str, repo: str) -> LocalRepository:
         if repository := self._get_repository(owner=owner, repo=repo):
@@ -541,8 +1259,8 @@ class RepositoryServer:
 
             self.logger.info(f"Cloning repository {owner}/{repo} to {repo_directory}")
 
-            branch: str = await asyncio.to_thread(self._clone_repository, owner=owner, repo=repo, directory=repo_directory)
+            branch, head_commit = await asyncio.to_thread(self._clone_repository, owner=owner, repo=repo, directory=repo_directory)
 
             self.logger.info(f"Cloned repository {owner}/{repo} to {repo_directory}")
 
-            return self._add_repository(owner=owner, repo=repo, branch=branch, local_path=repo_directory)
+            return self._add_repository(owner=owner, repo=repo, branch=branch, head_commit=head_commit, local_path=repo_directory)
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+
+def pytest_collection_modifyitems(items: list[pytest.Item]):
+    if not os.environ.get("CI"):
+        return
+
+    skip_on_ci = pytest.mark.skip(reason="Skipped when running on CI")
+
+    for item in items:
+        if "skip_on_ci" in item.keywords:
+            item.add_marker(skip_on_ci)
+
+
+def pytest_terminal_summary(terminalreporter: pytest.TerminalReporter):
+    """Show the properties recorded by tests (e.g. benchmark timings), which are otherwise only written to JUnit XML."""
+
+    reports: list[pytest.TestReport] = [
+        report
+        for stat_reports in terminalreporter.stats.values()
+        for report in stat_reports
+        if isinstance(report, pytest.TestReport) and report.when == "call" and report.user_properties
+    ]
+
+    if not reports:
+        return
+
+    terminalreporter.section("recorded properties")
+
+    for report in reports:
+        properties: str = ", ".join(f"{name}={value}" for name, value in report.user_properties)
+        terminalreporter.write_line(f"{report.nodeid}: {properties}")
@@ -1,12 +1,34 @@
+import asyncio
 import tempfile
+import timeit
+from collections.abc import Callable
 from logging import getLogger
 from pathlib import Path
 
 import pytest
+from git.repo import Repo
 from inline_snapshot import snapshot
 from pydantic import AnyHttpUrl
+from rpygrep.types import RipGrepContext, RipGrepSearchResult
 
-from github_code_search.servers.repository import FileEntryMatch, FileLines, FileWithMatches, RepositoryServer
+from github_code_search.servers.repository import (
+    DEFAULT_EXCLUDED_TYPES,
+    BasicFileInfo,
+    Directory,
+    DirectoryMissingError,
+    File,
+    FileEntryMatch,
+    FileLines,
+    FileWithMatches,
+    InvalidFilePathError,
+    LocalRepository,
+    QueryFileWithMatches,
+    RepositoryServer,
+    SearchQuery,
+    SingleFlight,
+    prepare_ripgrep_arguments,
+    search_result_to_file_entry_matches,
+)
 
 logger = getLogger(__name__)
 
@@ -175,3 +197,409 @@ async def test_simple_search_class_name_exclude_types(repository_server: Reposit
             )
         ]
     )
+
+
+@pytest.fixture
+def local_repository():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        repo_path: Path = Path(temp_dir)
+        repo: Repo = Repo.init(repo_path)
+
+        files: dict[str, str] = {
+            "README.md": "# Hello\n",
+            "src/package/__init__.py": "",
+            "src/package/module.py": "def hello_world():\n    pass\n",
+            "tests/test_module.py": "def test_hello_world():\n    pass\n",
+        }
+
+        for path, content in files.items():
+            file_path: Path = repo_path / path
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            _ = file_path.write_text(content)
+
+        _ = repo.index.add(list(files))
+        commit = repo.index.commit("initial")
+
+        yield LocalRepository(owner="owner", repo="repo", branch="main", head_commit=commit.hexsha, local_path=repo_path)
+
+
+async def test_list_directory_root(local_repository: LocalRepository):
+    directory: Directory = await local_repository.list_directory()
+
+    assert directory.files == snapshot(["README.md"])
+    assert directory.directories == snapshot(["src", "tests"])
+    assert directory.file_sizes is None
+    assert str(directory.url) == snapshot("https://github.com/owner/repo/tree/main")
+
+
+async def test_list_directory_recursive_with_sizes(local_repository: LocalRepository):
+    directory: Directory = await local_repository.list_directory(path="src/", depth=2, include_sizes=True)
+
+    assert directory.path == "src"
+    assert directory.files == snapshot(["src/package/__init__.py", "src/package/module.py"])
+    assert directory.directories == snapshot(["src/package"])
+    assert directory.file_sizes == snapshot({"src/package/__init__.py": 0, "src/package/module.py": 28})
+
+
+async def test_list_directory_missing(local_repository: LocalRepository):
+    with pytest.raises(DirectoryMissingError):
+        _ = await local_repository.list_directory(path="README.md")
+
+    with pytest.raises(DirectoryMissingError):
+        _ = await local_repository.list_directory(path="does/not/exist")
+
+    with pytest.raises(InvalidFilePathError):
+        _ = await local_repository.list_directory(path="../")
+
+
+@pytest.fixture
+def local_repository_server(local_repository: LocalRepository):
+    repository_server: RepositoryServer = RepositoryServer(logger=logger, clone_dir=local_repository.local_path.parent)
+    repository_server.repositories["owner/repo"] = local_repository
+    return repository_server
+
+
+async def test_search_code_batch(local_repository_server: RepositoryServer):
+    search_result: list[QueryFileWithMatches] = await local_repository_server.search_code_batch(
+        owner="owner",
+        repo="repo",
+        queries=[
+            SearchQuery(name="definitions", patterns=["def hello_world"]),
+            SearchQuery(name="tests", patterns=["def test_"]),
+            SearchQuery(name="readme", patterns=["hello"], include_globs=["*.md"]),
+        ],
+    )
+
+    assert [(result.query, str(result.url)) for result in search_result] == snapshot(
+        [
+            ("definitions", "https://github.com/owner/repo/blob/main/src/package/module.py"),
+            ("tests", "https://github.com/owner/repo/blob/main/tests/test_module.py"),
+            ("readme", "https://github.com/owner/repo/blob/main/README.md"),
+        ]
+    )
+
+
+async def test_search_code_batch_duplicate_names(local_repository_server: RepositoryServer):
+    with pytest.raises(ValueError, match="unique"):
+        _ = await local_repository_server.search_code_batch(
+            owner="owner",
+            repo="repo",
+            queries=[SearchQuery(name="query", patterns=["hello"]), SearchQuery(name="query", patterns=["world"])],
+        )
+
+
+async def test_search_code_batch_shared_scan_keeps_all_queries(
+    local_repository_server: RepositoryServer, local_repository: LocalRepository
+):
+    # The first query matches more lines than a shared per-file match limit would allow before the second query matches
+    _ = (local_repository.local_path / "matches.txt").write_text(
+        "".join(f"alpha {line_number}\n" for line_number in range(10)) + "filler\n" * 90 + "beta\n"
+    )
+
+    queries: list[SearchQuery] = [
+        SearchQuery(name="alpha", patterns=["alpha"], include_globs=["*.txt"]),
+        SearchQuery(name="beta", patterns=["beta"], include_globs=["*.txt"]),
+    ]
+
+    search_result: list[QueryFileWithMatches] = await local_repository_server.search_code_batch(owner="owner", repo="repo", queries=queries)
+
+    assert [(result.query, [match.match.line_numbers() for match in result.matches]) for result in search_result] == snapshot(
+        [("alpha", [[1], [2], [3], [4], [5], [6], [7]]), ("beta", [[101]])]
+    )
+
+    # Each query gets the same matches and context as it would from its own search
+    for query, result in zip(queries, search_result, strict=True):
+        own_search_result: list[FileWithMatches] = await local_repository_server.search_code(
+            owner="owner", repo="repo", patterns=query.patterns, include_globs=query.include_globs
+        )
+
+        assert [own_result.matches for own_result in own_search_result] == [result.matches]
+
+
+async def test_search_code_batch_unattributable_matches_fall_back_to_own_scans(local_repository_server: RepositoryServer):
+    # `\<` and `\>` are word boundaries in ripgrep but literal characters in Python
+    search_result: list[QueryFileWithMatches] = await local_repository_server.search_code_batch(
+        owner="owner",
+        repo="repo",
+        queries=[SearchQuery(name="word", patterns=[r"\<hello_world\>"]), SearchQuery(name="tests", patterns=["def test_"])],
+    )
+
+    assert [
+        (result.query, str(result.url), [match.match.line_numbers() for match in result.matches]) for result in search_result
+    ] == snapshot(
+        [
+            ("word", "https://github.com/owner/repo/blob/main/src/package/module.py", [[1]]),
+            ("tests", "https://github.com/owner/repo/blob/main/tests/test_module.py", [[1]]),
+        ]
+    )
+
+
+async def test_search_code_batch_pcre2_queries_get_own_scans(local_repository_server: RepositoryServer):
+    search_result: list[QueryFileWithMatches] = await local_repository_server.search_code_batch(
+        owner="owner",
+        repo="repo",
+        queries=[SearchQuery(name="lookahead", patterns=["hello(?=_world)"]), SearchQuery(name="word", patterns=[r"\<hello_world\>"])],
+    )
+
+    assert sorted((result.query, str(result.url)) for result in search_result) == snapshot(
+        [
+            ("lookahead", "https://github.com/owner/repo/blob/main/src/package/module.py"),
+            ("lookahead", "https://github.com/owner/repo/blob/main/tests/test_module.py"),
+            ("word", "https://github.com/owner/repo/blob/main/src/package/module.py"),
+        ]
+    )
+
+
+async def test_search_code_batch_groups_by_normalized_filters(local_repository_server: RepositoryServer):
+    search_result: list[QueryFileWithMatches] = await local_repository_server.search_code_batch(
+        owner="owner",
+        repo="repo",
+        queries=[
+            SearchQuery(name="default", patterns=["def test_"]),
+            SearchQuery(name="explicit", patterns=["def test_"], exclude_types=DEFAULT_EXCLUDED_TYPES),
+            SearchQuery(name="posix", patterns=["def [[:alpha:]]+_world"]),
+        ],
+    )
+
+    assert (
+        SearchQuery(name="default", patterns=[]).filters()
+        == SearchQuery(name="explicit", patterns=[], exclude_types=DEFAULT_EXCLUDED_TYPES).filters()
+    )
+
+    assert [(result.query, str(result.url)) for result in search_result] == snapshot(
+        [
+            ("default", "https://github.com/owner/repo/blob/main/tests/test_module.py"),
+            ("explicit", "https://github.com/owner/repo/blob/main/tests/test_module.py"),
+            ("posix", "https://github.com/owner/repo/blob/main/src/package/module.py"),
+        ]
+    )
+
+
+async def test_search_code_results_match_validated_models(local_repository_server: RepositoryServer):
+    search_result: list[FileWithMatches] = await local_repository_server.search_code(owner="owner", repo="repo", patterns=["hello_world"])
+
+    assert len(search_result) == 2
+
+    for file_with_matches in search_result:
+        assert FileWithMatches.model_validate(file_with_matches.model_dump()) == file_with_matches
+
+
+def baseline_search_result_to_file_entry_matches(
+    search_result: RipGrepSearchResult, before_context: int, after_context: int
+) -> list[FileEntryMatch]:
+    """A copy of the conversion from before the fast path, which validates every model it builds."""
+
+    line_context_by_line_number: dict[int, RipGrepContext] = {context.data.line_number: context for context in search_result.context}
+
+    file_entry_matches: list[FileEntryMatch] = []
+
+    for line_match in search_result.matches:
+        if not line_match.data.lines.text:
+            continue
+
+        before_context_lines: FileLines = FileLines(root={})
+        after_context_lines: FileLines = FileLines(root={})
+
+        for line_number in range(line_match.data.line_number - before_context, line_match.data.line_number):
+            if line := line_context_by_line_number.pop(line_number, None):  # noqa: SIM102
+                if text := line.data.lines.text:  # noqa: SIM102
+                    if stripped_line := text.rstrip():
+                        before_context_lines.root[line_number] = stripped_line
+
+        for line_number in range(line_match.data.line_number + 1, line_match.data.line_number + after_context + 1):
+            if line := line_context_by_line_number.pop(line_number, None):  # noqa: SIM102
+                if text := line.data.lines.text:  # noqa: SIM102
+                    if stripped_line := text.rstrip():
+                        after_context_lines.root[line_number] = stripped_line
+
+        file_entry_matches.append(
+            FileEntryMatch(
+                before=before_context_lines,
+                match=FileLines(root={line_match.data.line_number: line_match.data.lines.text.rstrip()}),
+                after=after_context_lines,
+            )
+        )
+
+    return file_entry_matches
+
+
+@pytest.mark.skip_on_ci
+async def test_search_result_overhead_benchmark(record_property: Callable[[str, object], None]):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for file_number in range(200):
+            _ = (Path(temp_dir) / f"module_{file_number}.py").write_text(
+                "\n".join(f"def function_{function_number}():\n    return {function_number}\n" for function_number in range(20))
+            )
+
+        repository: LocalRepository = LocalRepository(
+            owner="owner", repo="repo", branch="main", head_commit="benchmark", local_path=Path(temp_dir)
+        )
+
+        search_results: list[RipGrepSearchResult] = [result async for result in repository.code_search(patterns=["def function_"]).arun()]
+
+    def fast_path() -> list[FileWithMatches]:
+        return [
+            FileWithMatches.from_matches(
+                url=repository.generate_file_url(path=str(result.path)),
+                matches=search_result_to_file_entry_matches(search_result=result, before_context=4, after_context=4),
+            )
+            for result in search_results
+        ]
+
+    def baseline_path() -> list[FileWithMatches]:
+        return [
+            FileWithMatches(
+                url=AnyHttpUrl(
+                    f"{AnyHttpUrl(f'https://github.com/{repository.owner}/{repository.repo}/blob/{repository.branch}')}/{result.path}"
+                ),
+                matches=baseline_search_result_to_file_entry_matches(search_result=result, before_context=4, after_context=4),
+            )
+            for result in search_results
+        ]
+
+    assert fast_path() == baseline_path()
+
+    iterations: int = 20
+    fast_seconds: float = min(timeit.repeat(fast_path, number=iterations, repeat=3))
+    baseline_seconds: float = min(timeit.repeat(baseline_path, number=iterations, repeat=3))
+
+    per_result: int = iterations * len(search_results)
+
+    # Reported in the terminal summary by the conftest
+    record_property("fast_path_us_per_result", round(fast_seconds / per_result * 1e6, 1))
+    record_property("baseline_path_us_per_result", round(baseline_seconds / per_result * 1e6, 1))
+
+    assert fast_seconds < baseline_seconds
+
+
+def test_prepare_ripgrep_arguments():
+    assert prepare_ripgrep_arguments(
+        included_globs="*.py", excluded_globs=None, included_types=["python", "not-a-type"], excluded_types=None
+    ) == snapshot((["*.py"], [], ["python"], DEFAULT_EXCLUDED_TYPES))
+
+    assert prepare_ripgrep_arguments(included_globs=None, excluded_globs=["*.md"], included_types=None, excluded_types=[]) == snapshot(
+        ([], ["*.md"], [], [])
+    )
+
+    # Later globs override earlier ones, so their order is kept
+    assert prepare_ripgrep_arguments(
+        included_globs=["*.md", "!README.md", "*.md"], excluded_globs=None, included_types=None, excluded_types=[]
+    ) == snapshot((["*.md", "!README.md"], [], [], []))
+
+
+async def test_find_files_cached(local_repository_server: RepositoryServer, local_repository: LocalRepository):
+    find_result: list[BasicFileInfo] = await local_repository_server.find_files(owner="owner", repo="repo", include_types=["python"])
+
+    assert sorted(file_info.path for file_info in find_result) == snapshot(
+        ["src/package/__init__.py", "src/package/module.py", "tests/test_module.py"]
+    )
+
+    # The walk finished before max_results, so the same filters are now served from memory
+    (local_repository.local_path / "src" / "package" / "uncached.py").touch()
+
+    cached_file_list: list[str] = await local_repository.find_files(include_types=["python"], exclude_types=DEFAULT_EXCLUDED_TYPES)
+
+    assert sorted(cached_file_list) == sorted(file_info.path for file_info in find_result)
+
+
+async def test_find_files_stopped_early_twice_is_cached_in_background(local_repository: LocalRepository):
+    file_list: list[str] = await local_repository.find_files(include_types=["python"], max_results=1)
+
+    assert len(file_list) == 1
+
+    # A single truncated walk does not start a background walk
+    assert not local_repository._file_list_walks  # pyright: ignore[reportPrivateUsage]
+
+    assert len(await local_repository.find_files(include_types=["python"], max_results=1)) == 1
+
+    await asyncio.gather(*local_repository._file_list_walks.values())  # pyright: ignore[reportPrivateUsage]
+
+    (local_repository.local_path / "src" / "package" / "uncached.py").touch()
+
+    assert sorted(await local_repository.find_files(include_types=["python"])) == snapshot(
+        ["src/package/__init__.py", "src/package/module.py", "tests/test_module.py"]
+    )
+
+
+async def test_get_file_url_uses_requested_path(local_repository_server: RepositoryServer, local_repository: LocalRepository):
+    (local_repository.local_path / "LINK.md").symlink_to("README.md")
+
+    files: list[File] = await local_repository_server.get_files(owner="owner", repo="repo", paths=["./src/../LINK.md", "README.md"])
+
+    assert [(str(file.url), file.lines.root) for file in files] == snapshot(
+        [
+            ("https://github.com/owner/repo/blob/main/LINK.md", {1: "# Hello"}),
+            ("https://github.com/owner/repo/blob/main/README.md", {1: "# Hello"}),
+        ]
+    )
+
+
+async def test_identical_concurrent_calls_are_coalesced(local_repository_server: RepositoryServer):
+    search_results: list[list[FileWithMatches]] = await asyncio.gather(
+        *[local_repository_server.search_code(owner="owner", repo="repo", patterns=["hello_world"]) for _ in range(3)]
+    )
+
+    assert search_results[0] is search_results[1] is search_results[2]
+
+    files = await asyncio.gather(
+        local_repository_server.get_file(owner="owner", repo="repo", path="README.md"),
+        local_repository_server.get_file(owner="owner", repo="repo", path="./README.md"),
+        local_repository_server.get_file(owner="owner", repo="repo", path="src/package/module.py"),
+    )
+
+    assert files[0] is files[1]
+    assert files[0] is not files[2]
+
+    assert local_repository_server.saved_executions == snapshot({"search_code": 2, "get_file": 1})
+
+    # Once the shared execution has finished, later calls run again
+    _ = await local_repository_server.search_code(owner="owner", repo="repo", patterns=["hello_world"])
+
+    assert local_repository_server.saved_executions == snapshot({"search_code": 2, "get_file": 1})
+
+
+async def test_single_flight_cancels_execution_when_all_callers_leave():
+    single_flight: SingleFlight = SingleFlight()
+
+    started: asyncio.Event = asyncio.Event()
+    cancelled: asyncio.Event = asyncio.Event()
+
+    async def execute() -> None:
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    callers = [asyncio.create_task(single_flight.run(name="test", key="key", execute=execute)) for _ in range(2)]
+
+    _ = await started.wait()
+
+    _ = callers[0].cancel()
+    _ = await asyncio.gather(callers[0], return_exceptions=True)
+
+    # The other caller is still waiting, so the execution keeps going
+    assert not cancelled.is_set()
+
+    _ = callers[1].cancel()
+    _ = await asyncio.gather(callers[1], return_exceptions=True)
+
+    _ = await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+    assert single_flight.in_flight == {}
+    assert single_flight.saved_executions == snapshot({"test": 1})
+
+
+async def test_single_flight_shares_exceptions():
+    single_flight: SingleFlight = SingleFlight()
+
+    async def execute() -> None:
+        await asyncio.sleep(0)
+        msg = "failed"
+        raise ValueError(msg)
+
+    results = await asyncio.gather(*[single_flight.run(name="test", key="key", execute=execute) for _ in range(2)], return_exceptions=True)
+
+    assert [str(result) for result in results] == snapshot(["failed", "failed"])
+    assert single_flight.in_flight == {}